@@ -11,105 +11,236 @@ from pathlib import Path
 from datetime import datetime
 
 
-def ensure_database_schema(db_path):
+# Connection tuning applied to every connection opened by this module.
+# WAL + synchronous=NORMAL avoids an fsync per commit during bulk imports;
+# mmap_size lets reads come straight from the page cache (256 MB window).
+# journal_mode=WAL is persistent, the others are per-connection.
+# page_size only takes effect on a new (empty) database and must come before
+# journal_mode=WAL, which fixes the page size; existing databases keep theirs.
+CONNECTION_PRAGMAS = (
+    "PRAGMA page_size = 8192",
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -65536",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA foreign_keys = ON",
+)
+
+
+def _open_conn(db_path):
     """
-    Create database and tables if they don't exist.
+    Open a SQLite connection with the module's tuned PRAGMAs applied.
     
     Args:
         db_path: Path to SQLite database file
     
     Returns:
-        True if schema was created, False if already existed
+        sqlite3.Connection
     """
-    db_path = Path(db_path)
-    db_existed = db_path.exists()
-    
     conn = sqlite3.connect(str(db_path))
-    cursor = conn.cursor()
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+# Secondary (non-UNIQUE) indexes, by name. They are kept out of SCHEMA_SQL
+# so bulk loaders can drop them before inserting and rebuild each one
+# afterwards in a single sorted pass. UNIQUE constraints stay on the tables
+# (INSERT OR IGNORE relies on them) and their automatic indexes already
+# serve lookups on destination_file and on fits_file_id (the leading column
+# of UNIQUE(fits_file_id, ...)), so no extra index duplicates them.
+# organize_log.id is the rowid, which every index entry already carries, so
+# the destination_file -> id lookup is answered from the UNIQUE index alone.
+SECONDARY_INDEXES = {
+    'idx_organize_target': 'CREATE INDEX IF NOT EXISTS idx_organize_target ON organize_log(target)',
+    'idx_organize_session': 'CREATE INDEX IF NOT EXISTS idx_organize_session ON organize_log(session_date)',
+    'idx_metadata_key': 'CREATE INDEX IF NOT EXISTS idx_metadata_key ON fits_metadata(metadata_key)',
+    'idx_review_status': 'CREATE INDEX IF NOT EXISTS idx_review_status ON review_results(review_status)',
+}
+
+# Indexes created by earlier schema versions that duplicated a UNIQUE index;
+# dropped when an existing database is opened by ensure_database_schema()
+OBSOLETE_INDEXES = ('idx_organize_dest_file', 'idx_metadata_fits_id', 'idx_preview_fits_id')
+
+
+def drop_secondary_indexes(conn):
+    """
+    Drop the secondary indexes ahead of a bulk load.
+    
+    Readers lose index support until create_secondary_indexes() runs,
+    so only use this for offline imports.
+    
+    Args:
+        conn: Open sqlite3.Connection
+    """
+    for index_name in SECONDARY_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {index_name}")
+
+
+def create_secondary_indexes(conn):
+    """
+    Create the secondary indexes (existing ones are kept).
+    
+    Args:
+        conn: Open sqlite3.Connection
+    """
+    for index_sql in SECONDARY_INDEXES.values():
+        conn.execute(index_sql)
+
+
+# Tables (secondary indexes: SECONDARY_INDEXES). Every statement is
+# idempotent, so running it against an existing database only adds
+# whatever objects are missing.
+SCHEMA_SQL = """
+-- Main organize log table - tracks all FITS files
+CREATE TABLE IF NOT EXISTS organize_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_date TEXT NOT NULL,
+    target TEXT,
+    filter TEXT,
+    gain TEXT,
+    exposure_sec REAL,
+    temperature_c REAL,
+    timestamp TEXT,
+    source_file TEXT NOT NULL,
+    destination_file TEXT UNIQUE NOT NULL,
+    file_hash TEXT,
+    imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Long/skinny metadata table - stores all FITS header metadata
+CREATE TABLE IF NOT EXISTS fits_metadata (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    fits_file_id INTEGER NOT NULL,
+    metadata_key TEXT NOT NULL,
+    value_numeric REAL,
+    value_text TEXT,
+    imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (fits_file_id) REFERENCES organize_log(id) ON DELETE CASCADE,
+    UNIQUE(fits_file_id, metadata_key)
+);
+
+-- Preview log table - tracks JPEG generation
+CREATE TABLE IF NOT EXISTS preview_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    fits_file_id INTEGER NOT NULL,
+    status TEXT,
+    jpeg_file TEXT,
+    jpeg_collection_file TEXT,
+    processing_status TEXT,
+    imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (fits_file_id) REFERENCES organize_log(id) ON DELETE CASCADE,
+    UNIQUE(fits_file_id)
+);
+
+-- Review results table - tracks manual frame selection
+CREATE TABLE IF NOT EXISTS review_results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    fits_file_id INTEGER NOT NULL,
+    review_status TEXT,
+    reviewed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (fits_file_id) REFERENCES organize_log(id) ON DELETE CASCADE,
+    UNIQUE(fits_file_id)
+);
+
+-- Image statistics table - one wide typed row per FITS file
+-- (columns match the statistics keys of fits_metadata_utils.extract_fits_metadata)
+CREATE TABLE IF NOT EXISTS fits_image_stats (
+    fits_file_id INTEGER PRIMARY KEY,
+    mean REAL,
+    median REAL,
+    min REAL,
+    max REAL,
+    std REAL,
+    maxadu REAL,
+    saturation_threshold_used REAL,
+    pixels_saturated_low INTEGER,
+    pixels_saturated_high INTEGER,
+    total_pixels INTEGER,
+    percentile_05 REAL, percentile_10 REAL, percentile_15 REAL, percentile_20 REAL,
+    percentile_25 REAL, percentile_30 REAL, percentile_35 REAL, percentile_40 REAL,
+    percentile_45 REAL, percentile_50 REAL, percentile_55 REAL, percentile_60 REAL,
+    percentile_65 REAL, percentile_70 REAL, percentile_75 REAL, percentile_80 REAL,
+    percentile_85 REAL, percentile_90 REAL, percentile_95 REAL,
+    imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (fits_file_id) REFERENCES organize_log(id) ON DELETE CASCADE
+);
+"""
+
+# Value columns of fits_image_stats, in table order
+IMAGE_STATS_COLUMNS = (
+    'mean', 'median', 'min', 'max', 'std', 'maxadu', 'saturation_threshold_used',
+    'pixels_saturated_low', 'pixels_saturated_high', 'total_pixels',
+) + tuple(f'percentile_{p:02d}' for p in range(5, 100, 5))
+
+# Built once so every insert reuses the same statement text (sqlite3 statement cache)
+_INSERT_IMAGE_STATS_SQL = (
+    f"INSERT OR IGNORE INTO fits_image_stats (fits_file_id, {', '.join(IMAGE_STATS_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * (len(IMAGE_STATS_COLUMNS) + 1))})"
+)
+
+
+def ensure_database_schema(db_path, defer_indexes=False):
+    """
+    Create database and tables if they don't exist.
     
-    # Enable foreign key constraints
-    cursor.execute("PRAGMA foreign_keys = ON")
+    Args:
+        db_path: Path to SQLite database file
+        defer_indexes: Skip the secondary indexes, e.g. before a first bulk
+            import into a fresh database; call create_secondary_indexes()
+            once the data is loaded (one sorted build per index instead of
+            an index update per inserted row)
     
-    # Check if schema exists
-    cursor.execute("""
-        SELECT name FROM sqlite_master 
-        WHERE type='table' AND name='organize_log'
-    """)
+    Returns:
+        True if schema was created, False if already existed
+    """
+    db_path = Path(db_path)
     
-    schema_exists = cursor.fetchone() is not None
+    conn = _open_conn(db_path)
     
-    if not schema_exists:
-        print(f"Creating database schema in {db_path}")
-        
-        # Main organize log table - tracks all FITS files
-        cursor.execute('''
-            CREATE TABLE organize_log (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_date TEXT NOT NULL,
-                target TEXT,
-                filter TEXT,
-                gain TEXT,
-                exposure_sec REAL,
-                temperature_c REAL,
-                timestamp TEXT,
-                source_file TEXT NOT NULL,
-                destination_file TEXT UNIQUE NOT NULL,
-                file_hash TEXT,
-                imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+    # Closed on every path; an aborted script rolls back and releases its lock
+    try:
+        # Check if schema exists (only used for reporting; the DDL is idempotent)
+        schema_exists = conn.execute("""
+            SELECT name FROM sqlite_master 
+            WHERE type='table' AND name='organize_log'
+        """).fetchone() is not None
         
-        # Index for common queries
-        cursor.execute('''
-            CREATE INDEX idx_organize_target ON organize_log(target)
-        ''')
-        cursor.execute('''
-            CREATE INDEX idx_organize_session ON organize_log(session_date)
-        ''')
-        cursor.execute('''
-            CREATE INDEX idx_organize_dest_file ON organize_log(destination_file)
-        ''')
+        if not schema_exists:
+            print(f"Creating database schema in {db_path}")
         
-        # Long/skinny metadata table - stores all FITS header metadata
-        cursor.execute('''
-            CREATE TABLE fits_metadata (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                fits_file_id INTEGER NOT NULL,
-                metadata_key TEXT NOT NULL,
-                value_numeric REAL,
-                value_text TEXT,
-                imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (fits_file_id) REFERENCES organize_log(id) ON DELETE CASCADE,
-                UNIQUE(fits_file_id, metadata_key)
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE INDEX idx_metadata_key ON fits_metadata(metadata_key)
-        ''')
-        cursor.execute('''
-            CREATE INDEX idx_metadata_fits_id ON fits_metadata(fits_file_id)
-        ''')
-        
-        # Preview log table - tracks JPEG generation
-        cursor.execute('''
-            CREATE TABLE preview_log (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                fits_file_id INTEGER NOT NULL,
-                status TEXT,
-                jpeg_file TEXT,
-                jpeg_collection_file TEXT,
-                processing_status TEXT,
-                imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (fits_file_id) REFERENCES organize_log(id) ON DELETE CASCADE,
-                UNIQUE(fits_file_id)
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE INDEX idx_preview_fits_id ON preview_log(fits_file_id)
-        ''')
-        
-        # Review results table - tracks manual frame selection
-        cursor.execute('''​​​​​​​​​​​​​​​​
+        # Tables and indexes as one script inside a single write transaction
+        index_statements = [f"DROP INDEX IF EXISTS {index_name}" for index_name in OBSOLETE_INDEXES]
+        if not defer_indexes:
+            index_statements += SECONDARY_INDEXES.values()
+        index_sql = ';\n'.join(index_statements)
+        conn.executescript(f"BEGIN IMMEDIATE;\n{SCHEMA_SQL}\n{index_sql};\nCOMMIT;")
+    finally:
+        conn.close()
+    
+    return not schema_exists
+
 
+def insert_image_stats(conn, fits_file_id, stats):
+    """
+    Store the image statistics of one FITS file as a single fits_image_stats row.
+    
+    An existing row for the same file is left untouched.
+    
+    Args:
+        conn: Open sqlite3.Connection
+        fits_file_id: organize_log.id of the FITS file
+        stats: Dict from fits_metadata_utils.extract_fits_metadata()
+    
+    Returns:
+        True if a row was inserted, False if the file already had statistics
+    """
+    values = [fits_file_id]
+    for column in IMAGE_STATS_COLUMNS:
+        value = stats.get(column)
+        # Missing values ('' for maxadu) are stored as NULL
+        values.append(None if value == '' else value)
+    
+    cursor = conn.execute(_INSERT_IMAGE_STATS_SQL, values)
+    return cursor.rowcount == 1
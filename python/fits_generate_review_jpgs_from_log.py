@@ -7,12 +7,26 @@ Generates grayscale JPEG previews from files listed in fits_organizer TSV log
 import os
 import sys
 import argparse
+import csv
+from collections import defaultdict
 from datetime import datetime
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import shutil
 import numpy as np
 import pandas as pd
 
+# Import shared histogram and worker pool helpers
+try:
+    from fits_metadata_utils import integer_histogram, histogram_percentiles, pool_chunksize, \
+        positive_int
+    UTILS_AVAILABLE = True
+except ImportError:
+    UTILS_AVAILABLE = False
+    print("Error: fits_metadata_utils.py not found in the same directory")
+    sys.exit(1)
+
 try:
     from astropy.io import fits
     ASTROPY_AVAILABLE = True
@@ -33,12 +47,43 @@ except ImportError:
 
 try:
     import openpyxl
+    from openpyxl.utils import get_column_letter
     OPENPYXL_AVAILABLE = True
 except ImportError:
     OPENPYXL_AVAILABLE = False
     print("Warning: openpyxl not available. Excel export will be skipped.")
     print("Install with: pip install openpyxl")
 
+try:
+    import pyarrow
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+# Optional: pandas' pyarrow engine parses TSV logs multi-threaded
+TSV_READ_OPTIONS = {'engine': 'pyarrow'} if PYARROW_AVAILABLE else {}
+
+# Log columns used per frame, with defaults for columns missing from the log
+LOG_ROW_DEFAULTS = {'target': 'unknown', 'gain': 'unknown', 'exposure_sec': 'unknown',
+                    'temperature_c': 'unknown', 'timestamp': ''}
+
+
+def _log_value(entry, column, default):
+    """
+    Value of one organizer-log column as used in the preview log and folders
+    
+    Missing columns give the default; empty cells give 'nan' (as when the log
+    was read with pandas), which keeps existing collection folders stable.
+    """
+    value = entry.get(column)
+    if value is None:
+        return default
+    return value if value != '' else 'nan'
+
+
+# Autostretch percentiles of float frames are estimated from about this many pixels
+AUTOSTRETCH_SAMPLE_PIXELS = 1 << 20
+
 
 def autostretch(data, low_percentile=0.1, high_percentile=99.9):
     """
@@ -52,19 +97,70 @@ def autostretch(data, low_percentile=0.1, high_percentile=99.9):
     Returns:
         8-bit numpy array (0-255) suitable for JPEG
     """
-    # Calculate percentile values
-    low = np.percentile(data, low_percentile)
-    high = np.percentile(data, high_percentile)
-    
-    # Clip and scale to 0-1
-    if high > low:
-        stretched = np.clip((data - low) / (high - low), 0, 1)
+    if data.dtype.kind == 'u' and data.dtype.itemsize <= 2:
+        # 8/16-bit camera data (the common case): exact percentiles of every
+        # pixel from one histogram pass - no sort, partition or subsample
+        low, high = histogram_percentiles(integer_histogram(data),
+                                          [low_percentile, high_percentile])
     else:
+        # Estimate the clip points from a strided subsample of large frames (the
+        # tails are stable long before every pixel is seen). The stride is odd so
+        # all four positions of a Bayer mosaic are sampled alike.
+        stride = int(np.sqrt(data.size / AUTOSTRETCH_SAMPLE_PIXELS))
+        if stride > 1:
+            sample = data[::stride | 1, ::stride | 1]
+        else:
+            sample = data
+        
+        # Calculate both percentile values in one call (a single partition pass)
+        low, high = np.percentile(sample, [low_percentile, high_percentile])
+    
+    if not high > low:
         # Handle edge case where all values are similar
-        stretched = np.zeros_like(data, dtype=float)
+        return np.zeros(data.shape, dtype=np.uint8)
+    
+    # Scale to 0-255 and clip in place in a single float32 buffer (no
+    # full-size float64 temporaries)
+    stretched = np.subtract(data, low, dtype=np.float32)
+    np.multiply(stretched, np.float32(255 / (high - low)), out=stretched)
+    np.clip(stretched, 0, 255, out=stretched)
     
     # Convert to 8-bit
-    return (stretched * 255).astype(np.uint8)
+    return stretched.astype(np.uint8)
+
+
+def _bin_frame(data, step):
+    """
+    Average step x step pixel blocks of a 2D frame
+    
+    Edge rows/columns that do not fill a whole block are dropped. The blocks
+    are summed as step*step strided views in a wide accumulator (one pass
+    over the frame). Integer frames are rounded back to their own dtype, so
+    8/16-bit data keeps the histogram path of autostretch.
+    """
+    height = data.shape[0] // step * step
+    width = data.shape[1] // step * step
+    frame = data[:height, :width]
+    
+    if data.dtype.kind == 'u' and data.dtype.itemsize <= 2:
+        acc_dtype = np.uint32
+    elif data.dtype.kind in 'ui':
+        acc_dtype = np.int64
+    else:
+        acc_dtype = np.float32
+    
+    binned = np.zeros((height // step, width // step), dtype=acc_dtype)
+    for row in range(step):
+        for col in range(step):
+            binned += frame[row::step, col::step]
+    
+    count = step * step
+    if acc_dtype is np.float32:
+        binned /= count
+        return binned
+    binned += count // 2
+    binned //= count
+    return binned.astype(data.dtype)
 
 
 def fits_to_jpeg(fits_path, output_path, max_width=1920, low_pct=0.1, high_pct=99.9):
@@ -95,15 +191,27 @@ def fits_to_jpeg(fits_path, output_path, max_width=1920, low_pct=0.1, high_pct=9
             elif len(data.shape) != 2:
                 return False
             
+            height, width = data.shape
+            
+            # Frames at least twice the preview width are binned first, so
+            # stretch and resize only touch the pixels the preview can show;
+            # Lanczos then scales the rest of the way. Bayer frames use an even
+            # step, so every bin averages whole 2x2 CFA cells (R, G and B).
+            step = max(1, width // max_width)
+            if step > 1 and 'BAYERPAT' in hdul[0].header:
+                step -= step % 2
+            if step > 1:
+                data = _bin_frame(data, step)
+            
             # Apply autostretch
             stretched = autostretch(data, low_pct, high_pct)
             
             # Create PIL Image
             img = Image.fromarray(stretched, mode='L')
             
-            # Resize if needed (maintain aspect ratio)
-            if img.width > max_width:
-                aspect_ratio = img.height / img.width
+            # Resize if needed (maintain the original frame's aspect ratio)
+            if width > max_width:
+                aspect_ratio = height / width
                 new_width = max_width
                 new_height = int(max_width * aspect_ratio)
                 img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
@@ -111,8 +219,9 @@ def fits_to_jpeg(fits_path, output_path, max_width=1920, low_pct=0.1, high_pct=9
             # Ensure output directory exists
             output_path.parent.mkdir(parents=True, exist_ok=True)
             
-            # Save as JPEG
-            img.save(output_path, 'JPEG', quality=85, optimize=True)
+            # Save as JPEG (standard Huffman tables: optimize=True costs ~3.5x
+            # the encode time for ~2.5% smaller files)
+            img.save(output_path, 'JPEG', quality=85)
             
             return True
             
@@ -121,8 +230,99 @@ def fits_to_jpeg(fits_path, output_path, max_width=1920, low_pct=0.1, high_pct=9
         return False
 
 
+def _render_preview(fits_file, max_width, low_pct, high_pct):
+    """
+    Create the JPEG preview of one FITS file unless it already exists
+    
+    Runs in a worker process. The JPEG goes in a 'jpegs' subfolder next to
+    the FITS file.
+    
+    Returns:
+        Processing status: 'existing', 'generated' or 'failed'
+    """
+    fits_path = Path(fits_file)
+    jpeg_path = fits_path.parent / 'jpegs' / f"{fits_path.stem}.jpg"
+    
+    if jpeg_path.exists():
+        return 'existing'
+    if fits_to_jpeg(fits_path, jpeg_path, max_width, low_pct, high_pct):
+        return 'generated'
+    return 'failed'
+
+
+def _scan_jpgs(root):
+    """
+    Names of all .jpg files below root
+    
+    os.scandir walk: names come straight from the directory listing, with no
+    Path objects or per-file stat (symlinked directories are not followed)
+    """
+    names = set()
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith('.jpg'):
+                    names.add(entry.name)
+    return names
+
+
+def _collect_jpeg(src_jpeg, dst_jpeg, copy_mode='hardlink'):
+    """
+    Place a preview JPEG in the collection folder
+    
+    'hardlink' shares the file with the local 'jpegs' folder (no bytes
+    copied) and falls back to a copy where links are not possible
+    (another filesystem, no link support); 'copy' always copies.
+    """
+    # Replace an entry from an earlier run first: after a hardlink run it is
+    # the same inode as the source, which a copy onto it would refuse
+    if os.path.lexists(dst_jpeg):
+        os.unlink(dst_jpeg)
+    
+    if copy_mode == 'hardlink':
+        try:
+            os.link(src_jpeg, dst_jpeg)
+            return
+        except OSError:
+            pass
+    shutil.copy2(src_jpeg, dst_jpeg)
+
+
+def _realpath_cached(path, cache):
+    """
+    os.path.realpath with each parent directory resolved only once
+    
+    Frames of a night share a handful of folders, so the per-component
+    symlink walk of realpath is cached per folder (in the cache dict); a
+    file that is itself a symlink is still followed.
+    """
+    parent, name = os.path.split(os.fspath(path))
+    real_parent = cache.get(parent)
+    if real_parent is None:
+        real_parent = cache[parent] = os.path.realpath(parent)
+    real_path = os.path.join(real_parent, name)
+    if os.path.islink(real_path):
+        return os.path.realpath(real_path)
+    return real_path
+
+
+def _collection_folder(collection_dir, target, gain, exposure):
+    """
+    Collection folder of a preview: <target>/<gain>/<exposure>s, with the
+    names sanitized for use as folder names
+    """
+    target = str(target).replace(' ', '_').replace('/', '_')
+    gain = str(gain).replace(' ', '_')
+    exposure = str(exposure).replace(' ', '_').replace('.', 'p')
+    return collection_dir / target / gain / f"{exposure}s"
+
+
 def generate_previews_from_log(log_file, review_base_dir=None, max_width=1920, 
-                               low_pct=0.1, high_pct=99.9, include_calibration=False):
+                               low_pct=0.1, high_pct=99.9, include_calibration=False,
+                               copy_mode='hardlink', workers=None):
     """Generate JPEG previews from files listed in organizer log"""
     
     print("=" * 60)
@@ -130,37 +330,41 @@ def generate_previews_from_log(log_file, review_base_dir=None, max_width=1920,
     print("=" * 60)
     print()
     
-    # Read organizer log
+    # Read organizer log, streamed with the csv module and filtered for
+    # successfully copied frames as it is read
     print(f"Reading organizer log: {log_file}")
+    rows = []
+    log_entries = 0
     try:
-        log_df = pd.read_csv(log_file, sep='\t')
+        with open(log_file, newline='') as f:
+            for entry in csv.DictReader(f, delimiter='\t'):
+                log_entries += 1
+                if entry['action'] != 'copied':
+                    continue
+                # Light frames only unless calibration frames are included
+                if not include_calibration and 'light' not in (entry.get('frame_type') or '').lower():
+                    continue
+                rows.append((entry['destination_file'],) + tuple(
+                    _log_value(entry, col, default) for col, default in LOG_ROW_DEFAULTS.items()))
     except Exception as e:
         print(f"Error reading log file: {e}")
         return
     
-    print(f"Log contains {len(log_df)} entries")
+    print(f"Log contains {log_entries} entries")
     
-    # Filter for successfully copied frames
     if include_calibration:
-        # Include all frame types
-        frames_df = log_df[log_df['action'] == 'copied'].copy()
         print(f"Processing all frame types (lights + calibration)")
     else:
-        # Light frames only
-        frames_df = log_df[
-            (log_df['action'] == 'copied') & 
-            (log_df['frame_type'].str.contains('light', case=False, na=False))
-        ].copy()
         print(f"Processing light frames only (use --include-calibration for all frames)")
     
-    if len(frames_df) == 0:
+    if len(rows) == 0:
         if include_calibration:
             print("No successfully copied frames found in log")
         else:
             print("No successfully copied light frames found in log")
         return
     
-    print(f"Found {len(frames_df)} frames to process\n")
+    print(f"Found {len(rows)} frames to process\n")
     
     # Generate output log filename
     timestamp_now = datetime.now()
@@ -175,7 +379,7 @@ def generate_previews_from_log(log_file, review_base_dir=None, max_width=1920,
     # Determine review base directory
     if review_base_dir is None:
         # Use parent of first destination file
-        first_dest = Path(frames_df.iloc[0]['destination_file'])
+        first_dest = Path(rows[0][0])
         # Go up to find organized root (look for 'sessions' or 'calibration')
         review_base_dir = first_dest
         while review_base_dir.parent != review_base_dir:
@@ -195,129 +399,98 @@ def generate_previews_from_log(log_file, review_base_dir=None, max_width=1920,
     # Process files
     successful = 0
     failed = 0
-    preview_records = []
+    # Collection entries per collection folder: (capture time, local JPEG path)
+    collection_groups = defaultdict(list)
     start_time = datetime.now()
     
     # Calculate progress interval (1% of total files, minimum 1)
-    progress_interval = max(1, len(frames_df) // 100)
+    progress_interval = max(1, len(rows) // 100)
     
     # Flag to show early progress for large datasets
-    show_early_progress = len(frames_df) > 1000
+    show_early_progress = len(rows) > 1000
     early_progress_shown = False
     
     # Check for existing JPEGs to skip
     existing_jpegs = set()
+    collection_dir = review_base_dir / 'by_target_gain_exposure'
     if review_base_dir.exists():
-        collection_dir = review_base_dir / 'by_target_gain_exposure'
         if collection_dir.exists():
             # Find all existing JPEGs in collection
-            for jpeg_file in collection_dir.rglob('*.jpg'):
-                existing_jpegs.add(jpeg_file.name)
+            existing_jpegs = _scan_jpgs(collection_dir)
             print(f"Found {len(existing_jpegs)} existing JPEGs in collection - will skip these\n")
     
-    with open(preview_log_file, 'w') as log_f:
+    realpath_cache = {}
+    render = partial(_render_preview, max_width=max_width, low_pct=low_pct, high_pct=high_pct)
+    
+    # JPEGs are rendered in parallel worker processes; results come back in
+    # log order and this process remains the only preview log writer
+    # Log lines are buffered (1 MB) and flushed with each progress report
+    if workers is None:
+        workers = os.cpu_count() or 1
+    chunksize = pool_chunksize(len(rows), workers)
+    with open(preview_log_file, 'w', buffering=1 << 20) as log_f, ProcessPoolExecutor(max_workers=workers) as executor:
         # Write log header with new column order
         log_f.write('status\ttarget\tgain\texposure_sec\tcapture_time\ttemperature_c\tfits_file\tjpeg_file\tjpeg_collection_file\tprocessing_status\n')
         
-        for i, (idx, row) in enumerate(frames_df.iterrows(), 1):
-            fits_path = Path(row['destination_file'])
-            target = row.get('target', 'unknown')
-            gain = row.get('gain', 'unknown')
-            exposure = row.get('exposure_sec', 'unknown')
-            temperature = row.get('temperature_c', 'unknown')
-            timestamp_str = row.get('timestamp', '')
+        results = executor.map(render, [row[0] for row in rows], chunksize=chunksize)
+        for i, ((destination_file, target, gain, exposure, temperature, timestamp_str), processing_status) in enumerate(
+                zip(rows, results), 1):
+            fits_path = Path(destination_file)
             
-            # Create JPEG in 'jpegs' subfolder next to FITS file
-            jpeg_dir = fits_path.parent / 'jpegs'
-            jpeg_path = jpeg_dir / f"{fits_path.stem}.jpg"
+            # JPEG in 'jpegs' subfolder next to FITS file (see _render_preview)
+            jpeg_path = fits_path.parent / 'jpegs' / f"{fits_path.stem}.jpg"
             
             # Resolve symlinks to real paths for web access
-            fits_real_path = os.path.realpath(fits_path)
-            jpeg_real_path = os.path.realpath(jpeg_path)
+            fits_real_path = _realpath_cached(fits_path, realpath_cache)
+            jpeg_real_path = _realpath_cached(jpeg_path, realpath_cache)
             
-            # Check if JPEG already exists
-            if jpeg_path.exists():
-                # JPEG already exists - record it with 'existing' processing status
-                processing_status = 'existing'
+            if processing_status != 'failed':
+                # JPEG generated now or already there ('existing')
                 review_status = 'unverified'
                 successful += 1
                 
-                # Store record for collection
-                preview_records.append({
-                    'status': review_status,
-                    'target': target,
-                    'gain': gain,
-                    'exposure_sec': exposure,
-                    'capture_time': timestamp_str,
-                    'temperature_c': temperature,
-                    'fits_file': fits_real_path,
-                    'jpeg_file': jpeg_real_path,
-                    'jpeg_path': jpeg_path,
-                    'processing_status': processing_status
-                })
+                # Collection path is known up front (folder from target/gain/exposure,
+                # original filename), so the log line is complete when written
+                collection_folder = _collection_folder(collection_dir, target, gain, exposure)
+                collection_real_path = _realpath_cached(collection_folder / jpeg_path.name, realpath_cache)
+                
+                # Store entry for collection
+                collection_groups[collection_folder].append((timestamp_str, jpeg_path))
                 
                 # Write to log
-                log_f.write(f'{review_status}\t{target}\t{gain}\t{exposure}\t{timestamp_str}\t{temperature}\t{fits_real_path}\t{jpeg_real_path}\t\t{processing_status}\n')
-                log_f.flush()
+                log_f.write(f'{review_status}\t{target}\t{gain}\t{exposure}\t{timestamp_str}\t{temperature}\t{fits_real_path}\t{jpeg_real_path}\t{collection_real_path}\t{processing_status}\n')
             else:
-                # Convert to JPEG
-                success = fits_to_jpeg(fits_path, jpeg_path, max_width, low_pct, high_pct)
+                failed += 1
+                review_status = 'discarded'
                 
-                if success:
-                    successful += 1
-                    processing_status = 'generated'
-                    review_status = 'unverified'
-                    
-                    # Store record for collection
-                    preview_records.append({
-                        'status': review_status,
-                        'target': target,
-                        'gain': gain,
-                        'exposure_sec': exposure,
-                        'capture_time': timestamp_str,
-                        'temperature_c': temperature,
-                        'fits_file': fits_real_path,
-                        'jpeg_file': jpeg_real_path,
-                        'jpeg_path': jpeg_path,
-                        'processing_status': processing_status
-                    })
-                    
-                    # Write to log
-                    log_f.write(f'{review_status}\t{target}\t{gain}\t{exposure}\t{timestamp_str}\t{temperature}\t{fits_real_path}\t{jpeg_real_path}\t\t{processing_status}\n')
-                    log_f.flush()
-                else:
-                    failed += 1
-                    processing_status = 'failed'
-                    review_status = 'discarded'
-                    
-                    # Still record failed conversions
-                    log_f.write(f'{review_status}\t{target}\t{gain}\t{exposure}\t{timestamp_str}\t{temperature}\t{fits_real_path}\t\t\t{processing_status}\n')
-                    log_f.flush()
+                # Still record failed conversions
+                log_f.write(f'{review_status}\t{target}\t{gain}\t{exposure}\t{timestamp_str}\t{temperature}\t{fits_real_path}\t\t\t{processing_status}\n')
             
             # Show early progress after 10 files for large datasets
             if show_early_progress and i == 10 and not early_progress_shown:
                 timestamp = datetime.now().strftime('%H:%M:%S')
                 elapsed = (datetime.now() - start_time).total_seconds()
                 avg_time_per_file = elapsed / i
-                remaining_files = len(frames_df) - i
+                remaining_files = len(rows) - i
                 eta_seconds = avg_time_per_file * remaining_files
                 from datetime import timedelta
                 eta_time = datetime.now() + timedelta(seconds=eta_seconds)
                 eta_str = eta_time.strftime('%Y/%m/%d %H:%M')
-                percent_complete = (i / len(frames_df)) * 100
-                print(f"[{timestamp}] {percent_complete:5.1f}% - Processed {i}/{len(frames_df)} files "
+                percent_complete = (i / len(rows)) * 100
+                print(f"[{timestamp}] {percent_complete:5.1f}% - Processed {i}/{len(rows)} files "
                       f"({successful} successful, {failed} failed) - ETA: {eta_str}")
                 early_progress_shown = True
             
             # Show progress after processing at 1% intervals or last file
-            if i % progress_interval == 0 or i == len(frames_df):
+            if i % progress_interval == 0 or i == len(rows):
+                log_f.flush()
                 timestamp = datetime.now().strftime('%H:%M:%S')
                 elapsed = (datetime.now() - start_time).total_seconds()
                 
                 # Calculate ETA
                 if i > 0:
                     avg_time_per_file = elapsed / i
-                    remaining_files = len(frames_df) - i
+                    remaining_files = len(rows) - i
                     eta_seconds = avg_time_per_file * remaining_files
                     from datetime import timedelta
                     eta_time = datetime.now() + timedelta(seconds=eta_seconds)
@@ -325,8 +498,8 @@ def generate_previews_from_log(log_file, review_base_dir=None, max_width=1920,
                 else:
                     eta_str = "calculating..."
                 
-                percent_complete = (i / len(frames_df)) * 100
-                print(f"[{timestamp}] {percent_complete:5.1f}% - Processed {i}/{len(frames_df)} files "
+                percent_complete = (i / len(rows)) * 100
+                print(f"[{timestamp}] {percent_complete:5.1f}% - Processed {i}/{len(rows)} files "
                       f"({successful} successful, {failed} failed) - ETA: {eta_str}")
     
     print("\n" + "=" * 60)
@@ -335,74 +508,20 @@ def generate_previews_from_log(log_file, review_base_dir=None, max_width=1920,
         print(f"Failed: {failed} files")
     
     # Create collection organized by target/gain/exposure
-    if preview_records:
+    if collection_groups:
         print("\nCreating organized collection...")
-        collection_dir = review_base_dir / 'by_target_gain_exposure'
         collection_dir.mkdir(parents=True, exist_ok=True)
         
-        # Group by target, gain, exposure
-        from collections import defaultdict
-        groups = defaultdict(list)
-        
-        for record in preview_records:
-            # Sanitize names for folder structure
-            target = str(record['target']).replace(' ', '_').replace('/', '_')
-            gain = str(record['gain']).replace(' ', '_')
-            exposure = str(record['exposure_sec']).replace(' ', '_').replace('.', 'p')
-            
-            group_key = (target, gain, exposure)
-            groups[group_key].append(record)
-        
-        print(f"Creating {len(groups)} collection folders...")
-        
-        # Update log with collection paths
-        collection_mapping = {}
+        print(f"Creating {len(collection_groups)} collection folders...")
         
-        for (target, gain, exposure), records in groups.items():
+        for folder, entries in collection_groups.items():
             # Create folder: target/gain/exposure/
-            folder = collection_dir / target / gain / f"{exposure}s"
             folder.mkdir(parents=True, exist_ok=True)
             
-            # Copy JPEGs, sorted by capture time
-            records_sorted = sorted(records, key=lambda x: x['capture_time'])
-            
-            for record in records_sorted:
-                src_jpeg = record['jpeg_path']
+            # Link/copy JPEGs, sorted by capture time
+            for _, src_jpeg in sorted(entries, key=lambda entry: entry[0]):
                 # Keep original filename (which includes timestamp for sorting)
-                dst_jpeg = folder / src_jpeg.name
-                shutil.copy2(src_jpeg, dst_jpeg)
-                # Resolve symlink for collection path
-                dst_jpeg_real = os.path.realpath(dst_jpeg)
-                collection_mapping[record['jpeg_file']] = dst_jpeg_real
-        
-        # Update log file with collection paths
-        print("Updating preview log with collection paths...")
-        
-        # Read log back
-        with open(preview_log_file, 'r') as f:
-            lines = f.readlines()
-        
-        # Update collection column (column 9, index 8)
-        with open(preview_log_file, 'w') as f:
-            f.write(lines[0])  # Header
-            for line in lines[1:]:
-                parts = line.rstrip('\n').split('\t')
-                if len(parts) >= 8:
-                    jpeg_file = parts[7]  # jpeg_file is column 8 (index 7)
-                    collection_file = collection_mapping.get(jpeg_file, '')
-                    # Update collection path column (index 8)
-                    if len(parts) == 9:
-                        # Has processing_status but no collection path yet
-                        parts[8] = collection_file
-                    elif len(parts) == 10:
-                        # Already has both columns
-                        parts[8] = collection_file
-                    else:
-                        # Shouldn't happen, but handle gracefully
-                        while len(parts) < 10:
-                            parts.append('')
-                        parts[8] = collection_file
-                f.write('\t'.join(parts) + '\n')
+                _collect_jpeg(src_jpeg, folder / src_jpeg.name, copy_mode)
         
         # Copy the preview log to the collection directory
         collection_log_path = collection_dir / preview_log_filename
@@ -417,20 +536,27 @@ def generate_previews_from_log(log_file, review_base_dir=None, max_width=1920,
             
             try:
                 # Read the updated TSV log
-                log_df = pd.read_csv(preview_log_file, sep='\t')
+                log_df = pd.read_csv(preview_log_file, sep='\t', **TSV_READ_OPTIONS)
                 
-                # Group by target
-                targets = log_df['target'].unique()
+                # Group by target in one sorted pass (instead of a table scan
+                # per target); frames without a target (calibration) get their
+                # own 'nan' tab rather than breaking the sort
+                target_groups = log_df.groupby('target', sort=True, dropna=False)
                 
                 # Create Excel writer
                 with pd.ExcelWriter(excel_path, engine='openpyxl') as writer:
                     # Create a tab for each target
-                    for target in sorted(targets):
-                        target_df = log_df[log_df['target'] == target].copy()
-                        
+                    for target, target_df in target_groups:
                         # Sanitize sheet name (Excel has 31 char limit, no special chars)
                         sheet_name = str(target).replace('/', '_').replace('\\', '_')[:31]
                         
+                        # Column widths from the longest header/value text per
+                        # column (vectorized; empty cells count as '')
+                        column_widths = [
+                            max(len(str(column)), target_df[column].fillna('').astype(str).str.len().max()) + 2
+                            for column in target_df.columns
+                        ]
+                        
                         # Write to sheet
                         target_df.to_excel(writer, sheet_name=sheet_name, index=False)
                         
@@ -440,31 +566,18 @@ def generate_previews_from_log(log_file, review_base_dir=None, max_width=1920,
                         # Enable autofilter on header row
                         worksheet.auto_filter.ref = worksheet.dimensions
                         
-                        # Auto-adjust column widths based on content
-                        for column in worksheet.columns:
-                            max_length = 0
-                            column_letter = column[0].column_letter
-                            
-                            for cell in column:
-                                try:
-                                    cell_value = str(cell.value) if cell.value is not None else ''
-                                    if len(cell_value) > max_length:
-                                        max_length = len(cell_value)
-                                except:
-                                    pass
-                            
-                            # Add padding and set width (no cap for true auto-width)
-                            adjusted_width = max_length + 2
-                            worksheet.column_dimensions[column_letter].width = adjusted_width
+                        # Set column widths (padding included, no cap for true auto-width)
+                        for column_index, column_width in enumerate(column_widths, 1):
+                            worksheet.column_dimensions[get_column_letter(column_index)].width = column_width
                 
                 print(f"Created Excel workbook: {excel_path}")
-                print(f"  {len(targets)} tabs (one per target)")
+                print(f"  {target_groups.ngroups} tabs (one per target)")
             
             except Exception as e:
                 print(f"Warning: Could not create Excel file: {e}")
         
         print(f"Collection created: {collection_dir}")
-        print(f"  {len(groups)} folders (target/gain/exposure)")
+        print(f"  {len(collection_groups)} folders (target/gain/exposure)")
         print(f"  JPEGs sorted by capture time within each folder")
     
     print("\n" + "=" * 60)
@@ -475,7 +588,7 @@ def generate_previews_from_log(log_file, review_base_dir=None, max_width=1920,
         print(f"Failed:     {failed} files")
     print(f"Local JPEGs: Next to FITS files in 'jpegs' subdirectories")
     print(f"Collection:  {collection_dir}")
-    if preview_records:
+    if collection_groups:
         print(f"TSV log:     {collection_dir / preview_log_filename}")
         if OPENPYXL_AVAILABLE:
             excel_filename = preview_log_filename.replace('.tsv', '.xlsx')
@@ -541,6 +654,11 @@ Requirements:
                        help='Lower percentile for autostretch (default: 0.1)')
     parser.add_argument('--high', type=float, default=99.9,
                        help='Upper percentile for autostretch (default: 99.9)')
+    parser.add_argument('--copy-mode', choices=['hardlink', 'copy'], default='hardlink',
+                       help='How JPEGs are placed in the collection: hardlink (falls back to copy '
+                            'across filesystems) or copy (default: hardlink)')
+    parser.add_argument('--workers', '-j', type=positive_int, default=None,
+                       help='Number of worker processes (default: number of CPUs)')
     
     args = parser.parse_args()
     
@@ -556,7 +674,8 @@ Requirements:
     
     # Generate previews
     generate_previews_from_log(args.log_file, args.review_dir, args.width, 
-                               args.low, args.high, args.include_calibration)
+                               args.low, args.high, args.include_calibration,
+                               args.copy_mode, args.workers)
 
 
 if __name__ == '__main__':
@@ -8,12 +8,16 @@ Includes target extraction from organized filepath structure
 import os
 import sys
 import argparse
+import csv
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+from itertools import chain
 from pathlib import Path
 
 # Import shared metadata extraction utilities
 try:
-    from fits_metadata_utils import extract_fits_metadata, get_stats_column_names
+    from fits_metadata_utils import extract_fits_metadata, get_stats_column_names, jsonl_dumps, jsonl_loads, \
+        tsv_row, positive_int
     UTILS_AVAILABLE = True
 except ImportError:
     UTILS_AVAILABLE = False
@@ -29,21 +33,35 @@ except ImportError:
     print("Install with: pip install astropy")
     sys.exit(1)
 
+# File extensions recognized as FITS (case-insensitive)
+FITS_EXTENSIONS = ('.fit', '.fits', '.fts')
 
-def find_fits_files(directory):
-    """Recursively find all FITS files in directory"""
-    fits_extensions = ('.fit', '.fits', '.fts')
-    fits_files = []
+
+def iter_fits_files(directory):
+    """
+    Recursively yield all FITS files in directory, in sorted path order
     
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if file.lower().endswith(fits_extensions):
-                fits_files.append(os.path.join(root, file))
+    os.scandir walk: file types come from the directory listing, so no file
+    is stat'ed (symlinked directories are not followed, unreadable ones are
+    skipped, as with os.walk). Each directory is sorted on its own, with
+    subdirectories keyed as 'name/', which gives the same order as sorting
+    every path at once but lets the first files through before the walk ends.
+    """
+    try:
+        with os.scandir(directory) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name + '/'
+                             if entry.is_dir(follow_symlinks=False) else entry.name)
+    except OSError:
+        return
     
-    return sorted(fits_files)
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from iter_fits_files(entry.path)
+        elif entry.name.lower().endswith(FITS_EXTENSIONS):
+            yield entry.path
 
 
-def extract_all_metadata(input_dir, output_file=None, delete_json=False):
+def extract_all_metadata(input_dir, output_file=None, delete_json=False, workers=None):
     """Extract metadata from all FITS files in directory"""
     
     print("=" * 60)
@@ -51,16 +69,23 @@ def extract_all_metadata(input_dir, output_file=None, delete_json=False):
     print("=" * 60)
     print()
     
-    # Find all FITS files
+    # Walk the directory lazily; files are handed to the workers as they are
+    # found (fits_files collects them for the progress count)
     print(f"Scanning directory: {input_dir}")
-    fits_files = find_fits_files(input_dir)
+    fits_files = []
+    
+    def walk_fits_files():
+        for filepath in iter_fits_files(input_dir):
+            fits_files.append(filepath)
+            yield filepath
+    
+    fits_iter = walk_fits_files()
+    first_file = next(fits_iter, None)
     
-    if not fits_files:
+    if first_file is None:
         print(f"No FITS files found in {input_dir}")
         return
     
-    print(f"Found {len(fits_files)} FITS files\n")
-    
     # Generate output filename if not provided
     if output_file is None:
         timestamp_now = datetime.now()
@@ -78,31 +103,44 @@ def extract_all_metadata(input_dir, output_file=None, delete_json=False):
     print(f"TSV file (final): {tsv_file}")
     print("Writing incrementally to JSONL (safe for interruption)\n")
     
-    # Process files and append to JSONL incrementally
-    import json
-    
+    # Process files and append to JSONL incrementally; the complete TSV
+    # column set is collected on the way
+    all_keys = set()
     successful = 0
     failed = 0
     start_time = datetime.now()
     
-    # Calculate progress interval (1% of total files, minimum 1)
-    progress_interval = max(1, len(fits_files) // 100)
-    
-    # Flag to show early progress for large datasets
-    show_early_progress = len(fits_files) > 1000
-    early_progress_shown = False
-    
     print(f"[{datetime.now().strftime('%H:%M:%S')}] Processing files...\n")
     
-    with open(jsonl_file, 'w') as f:
-        for i, filepath in enumerate(fits_files, 1):
-            
-            metadata = extract_fits_metadata(filepath)
+    # Files are extracted in parallel worker processes; results come back in
+    # input order and this process remains the only JSONL writer. Records are
+    # buffered (1 MB) and flushed with each progress report, so an interrupted
+    # run loses at most the last 1% of files
+    if workers is None:
+        workers = os.cpu_count() or 1
+    with open(jsonl_file, 'wb', buffering=1 << 20) as f, ProcessPoolExecutor(max_workers=workers) as executor:
+        # The rest of the walk feeds the pool directly: each file is submitted
+        # as soon as it is found, so workers start while the walk is still
+        # going. map() returns once the walk is done and the total is known.
+        # Without a count up front, files are submitted one per task.
+        results = executor.map(extract_fits_metadata, chain([first_file], fits_iter))
+        
+        print(f"Found {len(fits_files)} FITS files\n")
+        
+        # Calculate progress interval (1% of total files, minimum 1)
+        progress_interval = max(1, len(fits_files) // 100)
+        next_report = progress_interval
+        
+        # Flag to show early progress for large datasets
+        show_early_progress = len(fits_files) > 1000
+        early_progress_shown = False
+        
+        for i, metadata in enumerate(results, 1):
             
             if metadata is not None:
                 # Write as single-line JSON
-                f.write(json.dumps(metadata) + '\n')
-                f.flush()  # Ensure data is written to disk
+                f.write(jsonl_dumps(metadata))
+                all_keys.update(metadata)
                 
                 if 'extraction_error' in metadata:
                     failed += 1
@@ -113,12 +151,13 @@ def extract_all_metadata(input_dir, output_file=None, delete_json=False):
             
             # Show early progress after 10 files for large datasets
             if show_early_progress and i == 10 and not early_progress_shown:
-                timestamp = datetime.now().strftime('%H:%M:%S')
-                elapsed = (datetime.now() - start_time).total_seconds()
+                now = datetime.now()
+                timestamp = now.strftime('%H:%M:%S')
+                elapsed = (now - start_time).total_seconds()
                 avg_time_per_file = elapsed / i
                 remaining_files = len(fits_files) - i
                 eta_seconds = avg_time_per_file * remaining_files
-                eta_time = datetime.now() + timedelta(seconds=eta_seconds)
+                eta_time = now + timedelta(seconds=eta_seconds)
                 eta_str = eta_time.strftime('%Y/%m/%d %H:%M')
                 percent_complete = (i / len(fits_files)) * 100
                 print(f"[{timestamp}] {percent_complete:5.1f}% - Processed {i}/{len(fits_files)} files "
@@ -126,16 +165,20 @@ def extract_all_metadata(input_dir, output_file=None, delete_json=False):
                 early_progress_shown = True
             
             # Show progress after processing at 1% intervals or last file
-            if i % progress_interval == 0 or i == len(fits_files):
-                timestamp = datetime.now().strftime('%H:%M:%S')
-                elapsed = (datetime.now() - start_time).total_seconds()
+            if i == next_report or i == len(fits_files):
+                next_report += progress_interval
+                f.flush()
+                # One clock read per report for timestamp, elapsed time and ETA
+                now = datetime.now()
+                timestamp = now.strftime('%H:%M:%S')
+                elapsed = (now - start_time).total_seconds()
                 
                 # Calculate ETA
                 if i > 0:
                     avg_time_per_file = elapsed / i
                     remaining_files = len(fits_files) - i
                     eta_seconds = avg_time_per_file * remaining_files
-                    eta_time = datetime.now() + timedelta(seconds=eta_seconds)
+                    eta_time = now + timedelta(seconds=eta_seconds)
                     eta_str = eta_time.strftime('%Y/%m/%d %H:%M')
                 else:
                     eta_str = "calculating..."
@@ -149,18 +192,9 @@ def extract_all_metadata(input_dir, output_file=None, delete_json=False):
     if failed > 0:
         print(f"[{timestamp}] Failed to process {failed} files")
     
-    # Now read all JSONL and create TSV with complete column set
+    # Now stream the JSONL into a TSV with the complete column set
     print(f"\n[{timestamp}] Creating final TSV with complete column set...")
     
-    all_metadata = []
-    all_keys = set()
-    
-    with open(jsonl_file, 'r') as f:
-        for line in f:
-            metadata = json.loads(line)
-            all_metadata.append(metadata)
-            all_keys.update(metadata.keys())
-    
     # Get stats keys for ordering
     stats_keys = get_stats_column_names()
     
@@ -170,23 +204,13 @@ def extract_all_metadata(input_dir, output_file=None, delete_json=False):
     
     ordered_keys = existing_stats_keys + header_keys
     
-    # Write TSV
-    with open(tsv_file, 'w') as f:
-        # Write header
-        f.write('\t'.join(ordered_keys) + '\n')
-        
-        # Write data rows
-        for metadata in all_metadata:
-            row = []
-            for key in ordered_keys:
-                value = metadata.get(key, '')
-                # Convert to string and handle special characters
-                if value is None:
-                    value = ''
-                else:
-                    value = str(value).replace('\t', ' ').replace('\n', ' ')
-                row.append(value)
-            f.write('\t'.join(row) + '\n')
+    # Stream the JSONL records into the TSV one row at a time. Cells
+    # are sanitized by tsv_row(), so the writer never has to quote or escape
+    with open(jsonl_file, 'rb') as fin, open(tsv_file, 'w') as f:
+        writer = csv.writer(f, delimiter='\t', lineterminator='\n',
+                            quoting=csv.QUOTE_NONE, quotechar=None)
+        writer.writerow(ordered_keys)
+        writer.writerows(tsv_row(jsonl_loads(line), ordered_keys) for line in fin)
     
     print(f"[{datetime.now().strftime('%H:%M:%S')}] TSV file created with {len(ordered_keys)} columns")
     
@@ -234,6 +258,8 @@ Examples:
     parser.add_argument('--output', '-o', help='Output file base name (default: fits_metadata_TIMESTAMP, creates .jsonl and .tsv)')
     parser.add_argument('--delete-json', action='store_true', 
                        help='Delete JSONL file after TSV creation (default: keep both files)')
+    parser.add_argument('--workers', '-j', type=positive_int, default=None,
+                       help='Number of worker processes (default: number of CPUs)')
     
     args = parser.parse_args()
     
@@ -247,7 +273,7 @@ Examples:
         sys.exit(1)
     
     # Run extraction
-    extract_all_metadata(args.input_dir, args.output, args.delete_json)
+    extract_all_metadata(args.input_dir, args.output, args.delete_json, args.workers)
 
 
 if __name__ == '__main__':
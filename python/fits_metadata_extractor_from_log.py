@@ -8,12 +8,14 @@ Processes only successfully copied files
 import os
 import sys
 import argparse
+import csv
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-import pandas as pd
 
 # Import shared metadata extraction utilities
 try:
-    from fits_metadata_utils import extract_fits_metadata, get_stats_column_names
+    from fits_metadata_utils import extract_fits_metadata, get_stats_column_names, pool_chunksize, \
+        jsonl_dumps, jsonl_loads, tsv_row, positive_int
     UTILS_AVAILABLE = True
 except ImportError:
     UTILS_AVAILABLE = False
@@ -30,7 +32,7 @@ except ImportError:
     sys.exit(1)
 
 
-def extract_metadata_from_log(log_file, output_file=None, delete_json=False):
+def extract_metadata_from_log(log_file, output_file=None, delete_json=False, workers=None):
     """Extract metadata from files listed in organizer log"""
     
     print("=" * 60)
@@ -38,24 +40,35 @@ def extract_metadata_from_log(log_file, output_file=None, delete_json=False):
     print("=" * 60)
     print()
     
-    # Read organizer log
+    # Columns from organizer log to include
+    log_columns = ['target', 'filter', 'exposure_sec', 'gain', 'temperature_c', 
+                   'temp_folder', 'timestamp']
+    
+    # Stream the organizer log, keeping only successfully copied files as
+    # (destination_file, *log values) tuples; values stay as logged (missing
+    # columns and empty cells become empty TSV cells)
     print(f"Reading organizer log: {log_file}")
+    rows = []
+    log_entries = 0
     try:
-        log_df = pd.read_csv(log_file, sep='\t')
+        with open(log_file, newline='') as f:
+            for entry in csv.DictReader(f, delimiter='\t'):
+                log_entries += 1
+                if entry['action'] != 'copied':
+                    continue
+                rows.append((entry['destination_file'],) + tuple(
+                    entry.get(col) or '' for col in log_columns))
     except Exception as e:
         print(f"Error reading log file: {e}")
         return
     
-    print(f"Log contains {len(log_df)} entries")
+    print(f"Log contains {log_entries} entries")
     
-    # Filter for successfully copied files only
-    copied_df = log_df[log_df['action'] == 'copied'].copy()
-    
-    if len(copied_df) == 0:
+    if len(rows) == 0:
         print("No successfully copied files found in log (action='copied')")
         return
     
-    print(f"Found {len(copied_df)} successfully copied files to process\n")
+    print(f"Found {len(rows)} successfully copied files to process\n")
     
     # Generate output filename if not provided
     if output_file is None:
@@ -76,41 +89,41 @@ def extract_metadata_from_log(log_file, output_file=None, delete_json=False):
     print(f"TSV file (final): {tsv_file}")
     print("Writing incrementally to JSONL (safe for interruption)\n")
     
-    # Process files and append to JSONL incrementally
-    import json
-    
-    # Columns from organizer log to include
-    log_columns = ['target', 'filter', 'exposure_sec', 'gain', 'temperature_c', 
-                   'temp_folder', 'timestamp']
-    
+    # Process files and append to JSONL incrementally; the complete TSV
+    # column set is collected on the way
+    all_keys = set()
     successful = 0
     failed = 0
     start_time = datetime.now()
     
     # Calculate progress interval (1% of total files, minimum 1)
-    progress_interval = max(1, len(copied_df) // 100)
+    progress_interval = max(1, len(rows) // 100)
+    next_report = progress_interval
     
     # Flag to show early progress for large datasets
-    show_early_progress = len(copied_df) > 1000
+    show_early_progress = len(rows) > 1000
     early_progress_shown = False
     
     print(f"[{datetime.now().strftime('%H:%M:%S')}] Processing files...\n")
     
-    with open(jsonl_file, 'w') as f:
-        for i, (idx, row) in enumerate(copied_df.iterrows(), 1):
-            filepath = row['destination_file']
-            
-            # Extract metadata from FITS file
-            metadata = extract_fits_metadata(filepath)
+    # Files are extracted in parallel worker processes; results come back in
+    # input order and this process remains the only JSONL writer. Records are
+    # buffered (1 MB) and flushed with each progress report, so an interrupted
+    # run loses at most the last 1% of files
+    if workers is None:
+        workers = os.cpu_count() or 1
+    chunksize = pool_chunksize(len(rows), workers)
+    with open(jsonl_file, 'wb', buffering=1 << 20) as f, ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(extract_fits_metadata, [row[0] for row in rows], chunksize=chunksize)
+        for i, ((filepath, *log_values), metadata) in enumerate(zip(rows, results), 1):
             
             if metadata is not None:
                 # Add log columns to metadata
-                for col in log_columns:
-                    metadata[col] = row.get(col, '')
+                metadata.update(zip(log_columns, log_values))
                 
                 # Write as single-line JSON
-                f.write(json.dumps(metadata) + '\n')
-                f.flush()  # Ensure data is written to disk
+                f.write(jsonl_dumps(metadata))
+                all_keys.update(metadata)
                 
                 if 'extraction_error' in metadata:
                     failed += 1
@@ -122,35 +135,40 @@ def extract_metadata_from_log(log_file, output_file=None, delete_json=False):
             
             # Show early progress after 10 files for large datasets
             if show_early_progress and i == 10 and not early_progress_shown:
-                timestamp = datetime.now().strftime('%H:%M:%S')
-                elapsed = (datetime.now() - start_time).total_seconds()
+                now = datetime.now()
+                timestamp = now.strftime('%H:%M:%S')
+                elapsed = (now - start_time).total_seconds()
                 avg_time_per_file = elapsed / i
-                remaining_files = len(copied_df) - i
+                remaining_files = len(rows) - i
                 eta_seconds = avg_time_per_file * remaining_files
-                eta_time = datetime.now() + timedelta(seconds=eta_seconds)
+                eta_time = now + timedelta(seconds=eta_seconds)
                 eta_str = eta_time.strftime('%Y/%m/%d %H:%M')
-                percent_complete = (i / len(copied_df)) * 100
-                print(f"[{timestamp}] {percent_complete:5.1f}% - Processed {i}/{len(copied_df)} files "
+                percent_complete = (i / len(rows)) * 100
+                print(f"[{timestamp}] {percent_complete:5.1f}% - Processed {i}/{len(rows)} files "
                       f"({successful} successful, {failed} failed) - ETA: {eta_str}")
                 early_progress_shown = True
             
             # Show progress after processing at 1% intervals or last file
-            if i % progress_interval == 0 or i == len(copied_df):
-                timestamp = datetime.now().strftime('%H:%M:%S')
-                elapsed = (datetime.now() - start_time).total_seconds()
+            if i == next_report or i == len(rows):
+                next_report += progress_interval
+                f.flush()
+                # One clock read per report for timestamp, elapsed time and ETA
+                now = datetime.now()
+                timestamp = now.strftime('%H:%M:%S')
+                elapsed = (now - start_time).total_seconds()
                 
                 # Calculate ETA
                 if i > 0:
                     avg_time_per_file = elapsed / i
-                    remaining_files = len(copied_df) - i
+                    remaining_files = len(rows) - i
                     eta_seconds = avg_time_per_file * remaining_files
-                    eta_time = datetime.now() + timedelta(seconds=eta_seconds)
+                    eta_time = now + timedelta(seconds=eta_seconds)
                     eta_str = eta_time.strftime('%Y/%m/%d %H:%M')
                 else:
                     eta_str = "calculating..."
                 
-                percent_complete = (i / len(copied_df)) * 100
-                print(f"[{timestamp}] {percent_complete:5.1f}% - Processed {i}/{len(copied_df)} files "
+                percent_complete = (i / len(rows)) * 100
+                print(f"[{timestamp}] {percent_complete:5.1f}% - Processed {i}/{len(rows)} files "
                       f"({successful} successful, {failed} failed) - ETA: {eta_str}")
     
     timestamp = datetime.now().strftime('%H:%M:%S')
@@ -158,18 +176,9 @@ def extract_metadata_from_log(log_file, output_file=None, delete_json=False):
     if failed > 0:
         print(f"[{timestamp}] Failed to process {failed} files")
     
-    # Now read all JSONL and create TSV with complete column set
+    # Now stream the JSONL into a TSV with the complete column set
     print(f"\n[{timestamp}] Creating final TSV with complete column set...")
     
-    all_metadata = []
-    all_keys = set()
-    
-    with open(jsonl_file, 'r') as f:
-        for line in f:
-            metadata = json.loads(line)
-            all_metadata.append(metadata)
-            all_keys.update(metadata.keys())
-    
     # Get stats keys for ordering
     stats_keys = get_stats_column_names()
     
@@ -180,23 +189,13 @@ def extract_metadata_from_log(log_file, output_file=None, delete_json=False):
     
     ordered_keys = existing_stats_keys + existing_log_columns + header_keys
     
-    # Write TSV
-    with open(tsv_file, 'w') as f:
-        # Write header
-        f.write('\t'.join(ordered_keys) + '\n')
-        
-        # Write data rows
-        for metadata in all_metadata:
-            row = []
-            for key in ordered_keys:
-                value = metadata.get(key, '')
-                # Convert to string and handle special characters
-                if value is None or (isinstance(value, float) and pd.isna(value)):
-                    value = ''
-                else:
-                    value = str(value).replace('\t', ' ').replace('\n', ' ')
-                row.append(value)
-            f.write('\t'.join(row) + '\n')
+    # Stream the JSONL records into the TSV one row at a time. Cells
+    # are sanitized by tsv_row(), so the writer never has to quote or escape
+    with open(jsonl_file, 'rb') as fin, open(tsv_file, 'w') as f:
+        writer = csv.writer(f, delimiter='\t', lineterminator='\n',
+                            quoting=csv.QUOTE_NONE, quotechar=None)
+        writer.writerow(ordered_keys)
+        writer.writerows(tsv_row(jsonl_loads(line), ordered_keys) for line in fin)
     
     print(f"[{datetime.now().strftime('%H:%M:%S')}] TSV file created with {len(ordered_keys)} columns")
     
@@ -245,6 +244,8 @@ Examples:
     parser.add_argument('--output', '-o', help='Output file base name (default: fits_metadata_TIMESTAMP, creates .jsonl and .tsv)')
     parser.add_argument('--delete-json', action='store_true',
                        help='Delete JSONL file after TSV creation (default: keep both files)')
+    parser.add_argument('--workers', '-j', type=positive_int, default=None,
+                       help='Number of worker processes (default: number of CPUs)')
     
     args = parser.parse_args()
     
@@ -254,7 +255,7 @@ Examples:
         sys.exit(1)
     
     # Run extraction
-    extract_metadata_from_log(args.log_file, args.output, args.delete_json)
+    extract_metadata_from_log(args.log_file, args.output, args.delete_json, args.workers)
 
 
 if __name__ == '__main__':
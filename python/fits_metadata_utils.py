@@ -4,6 +4,7 @@ Shared functions for extracting metadata and statistics from FITS files
 """
 
 import os
+import argparse
 import numpy as np
 
 try:
@@ -12,6 +13,57 @@ try:
 except ImportError:
     ASTROPY_AVAILABLE = False
 
+# Optional: orjson encodes/decodes the JSONL records several times faster
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    import json
+    ORJSON_AVAILABLE = False
+
+
+def jsonl_dumps(record):
+    """
+    Serialize one metadata record as a JSONL line (UTF-8 bytes, newline included)
+    
+    NaN values become null with orjson and NaN with the json fallback; both
+    read back as empty TSV cells.
+    """
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(record, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(record) + '\n').encode('utf-8')
+
+
+def jsonl_loads(line):
+    """Parse one JSONL line (bytes or str) back into a metadata record"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
+# Tabs and line breaks inside TSV cells become spaces (one translate pass)
+_TSV_SANITIZE = str.maketrans({'\t': ' ', '\n': ' ', '\r': ' '})
+
+
+def tsv_row(metadata, keys):
+    """
+    TSV cells of one metadata record, in keys order
+    
+    Missing, None and NaN values give empty cells (NaN reads back as None
+    with orjson, as float NaN with json); tabs and line breaks inside text
+    become spaces. Other values are formatted by csv.writer (str()).
+    """
+    row = []
+    for key in keys:
+        value = metadata.get(key)
+        if value is None or (isinstance(value, float) and value != value):
+            row.append('')
+        elif isinstance(value, str):
+            row.append(value.translate(_TSV_SANITIZE))
+        else:
+            row.append(value)
+    return row
+
 
 def extract_target_from_path(filepath):
     """
@@ -42,6 +94,80 @@ def extract_target_from_path(filepath):
     return ''
 
 
+# Header keywords left out of the metadata (multi-line free text, just clutter)
+SKIPPED_HEADER_KEYWORDS = frozenset({'COMMENT', 'HISTORY'})
+
+# Pixels per np.bincount call when histogramming (bounds the intp scratch copy)
+HISTOGRAM_BLOCK_PIXELS = 1 << 20
+
+
+def integer_histogram(data):
+    """
+    Pixel-value histogram of unsigned 8/16-bit image data
+    
+    Single pass over the data; hist[v] is the number of pixels equal to v
+    """
+    flat = data.ravel()
+    hist = np.zeros(int(np.iinfo(data.dtype).max) + 1, dtype=np.int64)
+    for start in range(0, flat.size, HISTOGRAM_BLOCK_PIXELS):
+        hist += np.bincount(flat[start:start + HISTOGRAM_BLOCK_PIXELS], minlength=hist.size)
+    return hist
+
+
+def _histogram_mean_std(hist):
+    """
+    Mean and standard deviation of the pixels described by a histogram
+    
+    Works on the (at most 65536) bins instead of the image - exact integer
+    sum for the mean, no float64 copy of the pixel data
+    """
+    total = int(hist.sum())
+    mean = int(np.dot(hist, np.arange(hist.size, dtype=np.int64))) / total
+    deviations = np.arange(hist.size, dtype=np.float64) - mean
+    variance = float(np.dot(hist, deviations * deviations)) / total
+    return mean, variance ** 0.5
+
+
+def histogram_percentiles(hist, q):
+    """
+    Percentiles of the pixels described by a histogram
+    
+    Same result as np.percentile(data, q) (linear interpolation) without
+    sorting or partitioning the image: positions in the sorted data are
+    looked up in the cumulative bin counts
+    """
+    cumulative = np.cumsum(hist)
+    positions = (cumulative[-1] - 1) * (np.asarray(q, dtype=np.float64) / 100)
+    lower_positions = np.floor(positions)
+    upper_positions = np.minimum(lower_positions + 1, cumulative[-1] - 1)
+    lower = np.searchsorted(cumulative, lower_positions, side='right').astype(np.float64)
+    upper = np.searchsorted(cumulative, upper_positions, side='right').astype(np.float64)
+    
+    # Interpolate the way np.percentile does (from the nearer end)
+    fraction = positions - lower_positions
+    step = upper - lower
+    return np.where(fraction >= 0.5, upper - step * (1 - fraction), lower + step * fraction)
+
+
+def _prefetch_file(filepath):
+    """
+    Hint the OS to start reading the whole file into the page cache
+    
+    Best effort (POSIX only); the statistics pass then reads from memory
+    instead of stalling on page faults
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        fd = os.open(filepath, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+
+
 def extract_fits_metadata(filepath):
     """
     Extract all header metadata and image statistics from a FITS file
@@ -58,6 +184,10 @@ def extract_fits_metadata(filepath):
         return _create_na_metadata(filepath, "astropy not available")
     
     try:
+        _prefetch_file(filepath)
+        
+        # Default open already memory-maps where possible; forcing memmap=True
+        # or do_not_scale_image_data breaks BZERO-offset uint16 frames
         with fits.open(filepath) as hdul:
             header = hdul[0].header
             data = hdul[0].data
@@ -65,13 +195,9 @@ def extract_fits_metadata(filepath):
             if data is None:
                 return _create_na_metadata(filepath, "no image data")
             
-            # Convert all header items to dict
-            metadata = {}
-            for key, value in header.items():
-                # Handle multi-line comments and special characters
-                if key == 'COMMENT' or key == 'HISTORY':
-                    continue  # Skip these to avoid clutter
-                metadata[key] = value
+            # Convert all header items to dict (astropy already returns typed values)
+            metadata = {key: value for key, value in header.items()
+                        if key not in SKIPPED_HEADER_KEYWORDS}
             
             # Get MAXADU explicitly (or mark as missing)
             maxadu_value = header.get('MAXADU', None)
@@ -81,31 +207,61 @@ def extract_fits_metadata(filepath):
                 saturation_threshold = float(maxadu_value)
             elif data.dtype == np.uint16:
                 saturation_threshold = 65535
+            elif np.issubdtype(data.dtype, np.integer):
+                saturation_threshold = int(np.iinfo(data.dtype).max)
             else:
-                saturation_threshold = np.iinfo(data.dtype).max if np.issubdtype(data.dtype, np.integer) else np.finfo(data.dtype).max
+                saturation_threshold = float(np.finfo(data.dtype).max)
+            
+            # 8/16-bit unsigned data (the common camera case): one histogram pass
+            # gives exact percentiles, mean/std and saturation counts without
+            # sorting or float64 upcasts of the frame; full-array passes otherwise
+            if data.dtype.kind == 'u' and data.dtype.itemsize <= 2:
+                hist = integer_histogram(data)
+            else:
+                hist = None
             
             # Calculate percentiles every 5th (5, 10, 15, ..., 95)
-            # Optimized: calculate all percentiles in one call (sorts data only once)
+            # Optimized: a single call also yields min (0th), max (100th)
+            # and median (50th) - no separate passes
             percentile_list = list(range(5, 100, 5))
-            percentile_values = np.percentile(data, percentile_list)
+            quantile_list = [0] + percentile_list + [100]
+            if hist is not None:
+                quantiles = histogram_percentiles(hist, quantile_list)
+            else:
+                quantiles = np.percentile(data, quantile_list)
+            data_min = quantiles[0]
+            data_max = quantiles[-1]
+            percentile_values = quantiles[1:-1]
             
             percentiles = {}
             for i, p in enumerate(percentile_list):
                 percentiles[f'percentile_{p:02d}'] = float(percentile_values[i])
             
+            # Saturation counts, mean and std
+            if hist is not None:
+                high_start = max(0, int(np.ceil(saturation_threshold)))
+                pixels_saturated_low = int(hist[int(data_min)])
+                pixels_saturated_high = int(hist[high_start:].sum())
+                data_mean, data_std = _histogram_mean_std(hist)
+            else:
+                pixels_saturated_low = int(np.count_nonzero(data == data_min))
+                pixels_saturated_high = int(np.count_nonzero(data >= saturation_threshold))
+                data_mean = float(np.mean(data))
+                data_std = float(np.std(data))
+            
             # Calculate image statistics
             stats = {
                 'filepath': str(filepath),
                 'target_from_path': extract_target_from_path(str(filepath)),
-                'mean': float(np.mean(data)),
-                'median': float(np.median(data)),
-                'min': float(np.min(data)),
-                'max': float(np.max(data)),
-                'std': float(np.std(data)),
+                'mean': data_mean,
+                'median': percentiles['percentile_50'],
+                'min': float(data_min),
+                'max': float(data_max),
+                'std': data_std,
                 'maxadu': maxadu_value if maxadu_value is not None else '',
                 'saturation_threshold_used': saturation_threshold,
-                'pixels_saturated_low': int(np.sum(data == np.min(data))),
-                'pixels_saturated_high': int(np.sum(data >= saturation_threshold)),
+                'pixels_saturated_low': pixels_saturated_low,
+                'pixels_saturated_high': pixels_saturated_high,
                 'total_pixels': int(data.size)
             }
             
@@ -158,3 +314,35 @@ def get_stats_column_names():
     percentile_keys = [f'percentile_{p:02d}' for p in range(5, 100, 5)]
     
     return stats_keys + percentile_keys
+
+
+# Upper bound on files handed to a pool worker per task (results come back in
+# order, so larger chunks only delay progress output)
+MAX_POOL_CHUNKSIZE = 8
+
+
+def pool_chunksize(n_files, workers):
+    """
+    Return the executor.map chunksize for n_files spread over workers
+    
+    Small runs get single-file tasks so every worker has something to do;
+    large runs batch up to MAX_POOL_CHUNKSIZE files per task to cut IPC
+    round trips.
+    """
+    return max(1, min(MAX_POOL_CHUNKSIZE, n_files // (workers * 4)))
+
+
+def positive_int(value):
+    """
+    argparse type for counts that must be at least 1 (e.g. --workers)
+    
+    Rejects 0 and negative values at parse time instead of letting the
+    process pool fail later.
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: '{value}'")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number